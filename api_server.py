@@ -1,11 +1,11 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
-import json
 import logging
-import hashlib
-import time
+import secrets
 from datetime import datetime, timedelta
+from passwords import PasswordHasher, HasherBusyError, needs_rehash
+from store import UserStore, SessionStore, atomic_write_json
 
 # 设置日志
 logging.basicConfig(
@@ -35,54 +35,51 @@ SESSIONS_FILE = os.path.join(DATA_DIR, 'sessions.json')
 for file in [USERS_FILE, SESSIONS_FILE]:
     try:
         if not os.path.exists(file):
-            with open(file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
+            atomic_write_json(file, {})
     except Exception as e:
         logger.error(f"初始化文件 {file} 失败: {str(e)}")
         raise
 
-def load_json_file(filename, default=None):
-    """加载JSON文件，如果文件不存在则返回默认值"""
-    try:
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return default if default is not None else {}
-    except Exception as e:
-        logger.error(f"加载文件 {filename} 失败: {str(e)}")
-        return default if default is not None else {}
-
-def save_json_file(filename, data):
-    """保存数据到JSON文件"""
-    try:
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"保存文件 {filename} 成功")
-    except Exception as e:
-        logger.error(f"保存文件 {filename} 失败: {str(e)}")
+# 加载用户和会话数据，Flask 请求线程和同进程的聊天服务器共用
+users = UserStore(USERS_FILE).load()
+sessions = SessionStore(SESSIONS_FILE).load()
 
-# 加载用户和会话数据
-users = load_json_file(USERS_FILE, {})
-sessions = load_json_file(SESSIONS_FILE, {})
+# 密码哈希在进程池中计算，避免阻塞请求线程和聊天服务器
+password_hasher = PasswordHasher()
 
-def hash_password(password):
-    """使用SHA-256哈希密码"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def busy_response():
+    return jsonify({
+        'success': False,
+        'error': '服务器繁忙，请稍后再试'
+    }), 503
 
 def generate_token():
     """生成随机令牌"""
-    return hashlib.sha256(str(time.time()).encode()).hexdigest()
+    return secrets.token_hex(32)
 
-def is_valid_session(token):
-    """检查会话是否有效"""
+def get_session(token):
+    """返回有效的会话，不存在或已过期时返回 None"""
     if not token:
-        return False
-    if token not in sessions:
-        return False
-    session = sessions[token]
+        return None
+    session = sessions.get(token)
+    if session is None:
+        return None
     expiry = datetime.fromisoformat(session['expiry'])
-    return expiry > datetime.now()
+    return session if expiry > datetime.now() else None
+
+def lookup_token(token):
+    """根据令牌查询用户信息，返回格式与 /api/user/info 相同"""
+    session = get_session(token)
+    if session is None:
+        return None
+    user = users.get(session['user_id'])
+    if not user or not isinstance(user, dict):
+        return None
+    return {
+        'success': True,
+        'user_id': session['user_id'],
+        'username': user.get('username', '')
+    }
 
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -118,22 +115,23 @@ def register():
             }), 400
         
         # 检查用户名是否已存在
-        if any(user.get('username') == username for user in users.values()):
+        user_id, _ = users.find_by_username(username)
+        if user_id is not None:
             return jsonify({
                 'success': False,
                 'error': '用户名已存在'
             }), 400
         
-        # 创建新用户
-        user_id = str(len(users) + 1)
-        users[user_id] = {
-            'username': username,
-            'password': hash_password(password),
-            'created_at': datetime.now().isoformat()
-        }
-        
-        # 保存用户数据
-        save_json_file(USERS_FILE, users)
+        # 创建新用户，并发注册同一用户名时只有一个成功
+        try:
+            password_hash = password_hasher.hash(password)
+        except HasherBusyError:
+            return busy_response()
+        if users.create(username, password_hash, datetime.now().isoformat()) is None:
+            return jsonify({
+                'success': False,
+                'error': '用户名已存在'
+            }), 400
         
         logger.info(f"新用户注册成功: {username}")
         return jsonify({
@@ -170,11 +168,12 @@ def login():
             }), 400
         
         # 验证用户
-        user_id = None
-        for uid, user in users.items():
-            if isinstance(user, dict) and user.get('username') == username and user.get('password') == hash_password(password):
-                user_id = uid
-                break
+        user_id, user = users.find_by_username(username)
+        try:
+            if user is None or not password_hasher.verify(password, user.get('password')):
+                user_id = None
+        except HasherBusyError:
+            return busy_response()
         
         if not user_id:
             logger.warning(f"登录失败: 用户名或密码错误 ({username})")
@@ -183,16 +182,18 @@ def login():
                 'error': '用户名或密码错误'
             }), 401
         
+        # 旧格式的密码哈希在登录成功时透明升级
+        if needs_rehash(user.get('password')):
+            try:
+                users.update(user_id, password=password_hasher.hash(password))
+                logger.info(f"已升级用户密码哈希: {username}")
+            except HasherBusyError:
+                pass  # 下次登录时再升级
+        
         # 创建新会话
         token = generate_token()
         expiry = datetime.now() + timedelta(days=7)  # 7天后过期
-        sessions[token] = {
-            'user_id': user_id,
-            'expiry': expiry.isoformat()
-        }
-        
-        # 保存会话数据
-        save_json_file(SESSIONS_FILE, sessions)
+        sessions.create(token, user_id, expiry.isoformat())
         logger.info(f"用户登录成功: {username}")
         
         return jsonify({
@@ -213,13 +214,11 @@ def login():
 def logout():
     try:
         token = request.headers.get('Authorization')
-        if token and token in sessions:
-            user_id = sessions[token]['user_id']
-            if user_id in users and isinstance(users[user_id], dict):
-                username = users[user_id].get('username', '')
-                del sessions[token]
-                save_json_file(SESSIONS_FILE, sessions)
-                logger.info(f"用户登出成功: {username}")
+        session = sessions.delete(token) if token else None
+        if session is not None:
+            user = users.get(session['user_id'])
+            if isinstance(user, dict):
+                logger.info(f"用户登出成功: {user.get('username', '')}")
         
         return jsonify({
             'success': True,
@@ -237,13 +236,14 @@ def logout():
 def get_user_info():
     try:
         token = request.headers.get('Authorization')
-        if not token or not is_valid_session(token):
+        session = get_session(token)
+        if session is None:
             return jsonify({
                 'success': False,
                 'error': '未登录或会话已过期'
             }), 401
         
-        user_id = sessions[token]['user_id']
+        user_id = session['user_id']
         user = users.get(user_id)
         
         if not user or not isinstance(user, dict):
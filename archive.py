@@ -0,0 +1,181 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+from records import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = 'data/archive'
+ARCHIVE_KINDS = ('lobby', 'private')
+# 超过该天数的消息从热数据移入归档分段
+ARCHIVE_AFTER_DAYS = 7
+# 归档分段粒度: day 或 month
+PARTITION_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m'}
+
+
+def segment_bounds(key):
+    """根据分段键返回分段覆盖的 [开始, 结束) 时间，分段粒度由键的格式决定"""
+    try:
+        start = datetime.strptime(key, PARTITION_FORMATS['day'])
+        return start, start + timedelta(days=1)
+    except ValueError:
+        start = datetime.strptime(key, PARTITION_FORMATS['month'])
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+class HistoryArchive:
+    """按时间分段的聊天记录归档
+
+    冷数据按天或按月写入 gzip 压缩的 JSON Lines 分段文件，大厅与私聊分别
+    存放并各自设置保留天数。partition 只决定新写入的分段，读取和清理按
+    分段文件名判断粒度，因此修改粒度后旧分段仍然有效。
+    这里的方法都是阻塞IO，应在线程池中调用。
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, partition='month', retention_days=None):
+        if partition not in PARTITION_FORMATS:
+            raise ValueError(f"不支持的分段粒度: {partition}")
+        self.archive_dir = archive_dir
+        self.partition = partition
+        self.retention_days = retention_days or {}  # {kind: 天数}，未设置表示永久保留
+
+    def segment_key(self, ts_ms):
+        return datetime.fromtimestamp(ts_ms / 1000).strftime(PARTITION_FORMATS[self.partition])
+
+    def segment_path(self, kind, key):
+        return os.path.join(self.archive_dir, kind, f"{key}.jsonl.gz")
+
+    def segments(self, kind):
+        """按时间顺序返回 [(分段键, 开始时间, 结束时间, 路径)]，忽略无法识别的文件"""
+        directory = os.path.join(self.archive_dir, kind)
+        if not os.path.isdir(directory):
+            return []
+        segments = []
+        for name in os.listdir(directory):
+            if not name.endswith('.jsonl.gz'):
+                continue
+            key = name[:-len('.jsonl.gz')]
+            try:
+                start, end = segment_bounds(key)
+            except ValueError:
+                continue
+            segments.append((key, start, end, os.path.join(directory, name)))
+        segments.sort(key=lambda segment: (segment[1], segment[2]))
+        return segments
+
+    def write(self, kind, records):
+        """把记录追加到对应的分段，gzip 追加写入会形成多成员文件，读取时自动连接"""
+        by_segment = {}
+        for record in records:
+            by_segment.setdefault(self.segment_key(record.ts), []).append(record)
+        for key, segment_records in by_segment.items():
+            path = self.segment_path(kind, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for record in segment_records:
+                    f.write(json.dumps(record.to_dict(), ensure_ascii=False))
+                    f.write('\n')
+        if records:
+            logger.info(f"已归档 {len(records)} 条{kind}消息到 {len(by_segment)} 个分段")
+
+    def apply_retention(self, now=None):
+        """删除超过保留期限的分段"""
+        now = now or datetime.now()
+        removed = 0
+        for kind, days in self.retention_days.items():
+            if days is None:
+                continue
+            cutoff = now - timedelta(days=days)
+            for _, _, end, path in self.segments(kind):
+                # 整段都早于截止时间时才删除
+                if end <= cutoff:
+                    os.remove(path)
+                    removed += 1
+        if removed:
+            logger.info(f"已删除 {removed} 个过期归档分段")
+        return removed
+
+    def iter_segment_lines(self, kind, start, end):
+        """逐行读取 [start, end] 日期范围内的归档消息，返回原始 JSON 行"""
+        start_text = start.strftime("%Y-%m-%d %H:%M:%S")
+        end_text = end.strftime("%Y-%m-%d %H:%M:%S")
+        for _, segment_start, segment_end, path in self.segments(kind):
+            if segment_end <= start or segment_start > end:
+                continue
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    timestamp = json.loads(line).get('timestamp', '')
+                    if start_text <= timestamp <= end_text:
+                        yield line if line.endswith('\n') else line + '\n'
+
+    def export(self, kind, start, end, out, hot_messages=()):
+        """把日期范围内的归档和热数据以 JSON Lines 写入 out，返回写入条数"""
+        count = 0
+        for line in self.iter_segment_lines(kind, start, end):
+            out.write(line)
+            count += 1
+        start_ms = int(start.timestamp() * 1000)
+        end_ms = int(end.timestamp() * 1000)
+        for record in hot_messages:
+            if record.ts is not None and start_ms <= record.ts <= end_ms:
+                out.write(json.dumps(record.to_dict(), ensure_ascii=False))
+                out.write('\n')
+                count += 1
+        return count
+
+
+def parse_date_range(start, end):
+    """解析 YYYY-MM-DD 格式的日期范围，结束日期包含当天"""
+    start_dt = datetime.strptime(start, '%Y-%m-%d')
+    end_dt = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) - timedelta(seconds=1)
+    return start_dt, end_dt
+
+
+def iter_hot_messages(kind, messages_file='data/messages.json', private_messages_file='data/private_messages.json'):
+    """读取热数据文件中的消息，私聊每条只返回一次"""
+    path = messages_file if kind == 'lobby' else private_messages_file
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if kind == 'lobby':
+        for msg in data:
+            yield MessageRecord.from_dict(msg)
+        return
+    for user, conversations in data.items():
+        for messages in conversations.values():
+            for msg in messages:
+                if msg.get('from') == user:
+                    yield MessageRecord.from_dict(msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='洛²聊天记录归档工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='按日期范围导出聊天记录为 JSON Lines')
+    export_parser.add_argument('start', help='开始日期 YYYY-MM-DD')
+    export_parser.add_argument('end', help='结束日期 YYYY-MM-DD（包含当天）')
+    export_parser.add_argument('--kind', choices=ARCHIVE_KINDS, default='lobby', help='导出大厅或私聊记录（默认：lobby）')
+    export_parser.add_argument('-o', '--output', help='输出文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    start, end = parse_date_range(args.start, args.end)
+    archive = HistoryArchive()
+    hot_messages = iter_hot_messages(args.kind)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            count = archive.export(args.kind, start, end, out, hot_messages)
+    else:
+        count = archive.export(args.kind, start, end, sys.stdout, hot_messages)
+    print(f"已导出 {count} 条消息", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
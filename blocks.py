@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 日志条数超过有效屏蔽关系数的倍数时重写日志
+COMPACT_RATIO = 2
+COMPACT_MIN_ENTRIES = 100
+
+
+class BlockIndex:
+    """双向屏蔽索引
+
+    blocked 保存 屏蔽者 -> 被屏蔽者集合，blockers 保存 被屏蔽者 -> 屏蔽者集合，
+    两个方向的查询都是集合操作。每次变更只向日志文件追加一行，
+    日志过长时再整体重写为当前的屏蔽关系。
+    """
+
+    def __init__(self, log_file='data/blocks.log'):
+        self.log_file = log_file
+        self.blocked = {}  # {user: {blocked_users}}
+        self.blockers = {}  # {user: {users_who_blocked_user}}
+        self.log_entries = 0
+
+    def load(self):
+        """回放日志重建索引"""
+        try:
+            if os.path.exists(self.log_file):
+                with open(self.log_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        if entry.get('op') == 'block':
+                            self._add(entry['user'], entry['target'])
+                        elif entry.get('op') == 'unblock':
+                            self._remove(entry['user'], entry['target'])
+                        self.log_entries += 1
+                logger.info(f"已加载 {self.count()} 条屏蔽关系")
+        except Exception as e:
+            logger.error(f"加载屏蔽列表失败: {str(e)}")
+
+    def count(self):
+        return sum(len(targets) for targets in self.blocked.values())
+
+    def is_blocked(self, user, target):
+        """user 是否屏蔽了 target"""
+        return target in self.blocked.get(user, ())
+
+    def blockers_of(self, user):
+        """返回屏蔽了 user 的用户集合"""
+        return self.blockers.get(user, frozenset())
+
+    def block(self, user, target):
+        if self.is_blocked(user, target):
+            return False
+        self._add(user, target)
+        self._append('block', user, target)
+        return True
+
+    def unblock(self, user, target):
+        if not self.is_blocked(user, target):
+            return False
+        self._remove(user, target)
+        self._append('unblock', user, target)
+        return True
+
+    def _add(self, user, target):
+        self.blocked.setdefault(user, set()).add(target)
+        self.blockers.setdefault(target, set()).add(user)
+
+    def _remove(self, user, target):
+        targets = self.blocked.get(user)
+        if targets is not None:
+            targets.discard(target)
+            if not targets:
+                del self.blocked[user]
+        users = self.blockers.get(target)
+        if users is not None:
+            users.discard(user)
+            if not users:
+                del self.blockers[target]
+
+    def _append(self, op, user, target):
+        try:
+            os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"op": op, "user": user, "target": target}, ensure_ascii=False) + '\n')
+            self.log_entries += 1
+        except Exception as e:
+            logger.error(f"保存屏蔽列表失败: {str(e)}")
+            return
+        if self.log_entries > COMPACT_MIN_ENTRIES and self.log_entries > self.count() * COMPACT_RATIO:
+            self.compact()
+
+    def compact(self):
+        """把日志重写为当前的屏蔽关系，先写临时文件再替换"""
+        tmp_file = self.log_file + '.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for user, targets in self.blocked.items():
+                    for target in targets:
+                        f.write(json.dumps({"op": "block", "user": user, "target": target}, ensure_ascii=False) + '\n')
+            os.replace(tmp_file, self.log_file)
+            self.log_entries = self.count()
+        except Exception as e:
+            logger.error(f"压缩屏蔽日志失败: {str(e)}")
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+from protocol import ENCODING_JSON, encode_message
+
+logger = logging.getLogger(__name__)
+
+# 同一 (发送者, 目标) 的瞬时事件在该时间窗口内合并（秒）
+EPHEMERAL_WINDOW = 0.3
+# 连接写缓冲超过该字节数时丢弃瞬时事件
+EPHEMERAL_MAX_BUFFER = 64 * 1024
+
+
+class EphemeralChannel:
+    """瞬时事件通道，用于输入状态等高频、无需保存的信号
+
+    事件不分配序号、不进入重放缓冲、不写入任何记录。同一窗口内
+    同一 (发送者, 目标, 类型) 只保留最后一次，接收方写缓冲积压时直接丢弃。
+    """
+
+    def __init__(self, chat_server, window=EPHEMERAL_WINDOW, max_buffer=EPHEMERAL_MAX_BUFFER):
+        self.chat_server = chat_server
+        self.window = window
+        self.max_buffer = max_buffer
+        self.pending = {}  # {(sender, target, type): message}
+        self.flush_task = None
+        self.dropped = 0
+
+    def publish(self, sender, target, message):
+        """提交事件，target 为 None 时发给大厅所有在线用户"""
+        self.pending[(sender, target, message["type"])] = message
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self.flush_task = None
+        await self.flush()
+
+    def _congested(self, websocket):
+        transport = getattr(websocket, 'transport', None)
+        if transport is None:
+            return False
+        return transport.get_write_buffer_size() > self.max_buffer
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        server = self.chat_server
+        # 每次刷新只建立一次 用户名 -> 连接 的映射
+        connections = {}
+        for websocket, username in server.users.items():
+            connections.setdefault(username, []).append(websocket)
+
+        sends = []
+        for (sender, target, _), message in pending.items():
+            blockers = server.blocks.blockers_of(sender)
+            if target is None:
+                recipients = [
+                    websocket for username, sockets in connections.items()
+                    if username != sender and username not in blockers
+                    for websocket in sockets
+                ]
+            elif target in blockers:
+                continue
+            else:
+                recipients = connections.get(target, [])
+
+            payloads = {}
+            for websocket in recipients:
+                if self._congested(websocket):
+                    self.dropped += 1
+                    continue
+                encoding = server.encodings.get(websocket, ENCODING_JSON)
+                if encoding not in payloads:
+                    payloads[encoding] = encode_message(message, encoding)
+                sends.append(server.write(websocket, payloads[encoding]))
+        if sends:
+            await asyncio.gather(*sends, return_exceptions=True)
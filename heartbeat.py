@@ -0,0 +1,147 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# 客户端心跳间隔与超时时间（秒）
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 90
+# 时间轮每格的时长（秒）
+WHEEL_TICK = 1.0
+# 连接断开后归还空闲内存的最小间隔（秒）
+TRIM_INTERVAL = 300
+
+
+def _load_malloc_trim():
+    """glibc 下返回 malloc_trim，用于把空闲堆内存归还给系统，其他平台返回 None"""
+    try:
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            return None
+        return ctypes.CDLL(libc_name).malloc_trim
+    except (OSError, AttributeError):
+        return None
+
+
+_malloc_trim = _load_malloc_trim()
+
+
+def trim_memory():
+    """尝试把空闲堆内存归还给系统
+
+    不强制执行完整的 gc.collect()：内存中的消息记录都被 GC 跟踪，
+    完整回收的耗时随历史消息数增长，循环引用交给解释器按代自动回收。
+    """
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+
+def process_rss():
+    """返回当前进程的常驻内存（字节），无法获取时返回 None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ConnectionStats:
+    """单个连接的资源统计"""
+    __slots__ = ('connected_at', 'last_seen', 'messages_in', 'bytes_in', 'messages_out', 'bytes_out',
+                 'pending_writes')
+
+    def __init__(self):
+        now = time.monotonic()
+        self.connected_at = now
+        self.last_seen = now
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.pending_writes = 0  # 已排队但尚未写入传输层的消息数
+
+    def record_in(self, size):
+        self.last_seen = time.monotonic()
+        self.messages_in += 1
+        self.bytes_in += size
+
+    def record_out(self, size):
+        self.messages_out += 1
+        self.bytes_out += size
+
+
+class HeartbeatMonitor:
+    """基于时间轮的心跳超时检测
+
+    每个连接只登记在时间轮的一个格子里，收到任何消息时移动到
+    “当前格 + 超时格数”的位置。整个服务器只有一个定时任务推进时间轮，
+    转到的格子里剩下的连接即为超时连接。
+    """
+
+    def __init__(self, on_timeout, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT, tick=WHEEL_TICK):
+        self.on_timeout = on_timeout
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self.timeout_ticks = max(1, int(-(-timeout // tick)))
+        self.slots = [set() for _ in range(self.timeout_ticks + 1)]
+        self.positions = {}  # {websocket: 格子下标}
+        self.cursor = 0
+        self.task = None
+        self.last_trim = time.monotonic()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def touch(self, websocket):
+        """登记或刷新连接的活跃时间"""
+        slot = (self.cursor + self.timeout_ticks) % len(self.slots)
+        old = self.positions.get(websocket)
+        if old == slot:
+            return
+        if old is not None:
+            self.slots[old].discard(websocket)
+        self.slots[slot].add(websocket)
+        self.positions[websocket] = slot
+
+    def remove(self, websocket):
+        slot = self.positions.pop(websocket, None)
+        if slot is not None:
+            self.slots[slot].discard(websocket)
+
+    def __len__(self):
+        return len(self.positions)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            expired = self.slots[self.cursor]
+            if not expired:
+                continue
+            self.slots[self.cursor] = set()
+            for websocket in expired:
+                self.positions.pop(websocket, None)
+            logger.info(f"心跳超时，回收 {len(expired)} 个连接")
+            for websocket in expired:
+                try:
+                    await self.on_timeout(websocket)
+                except Exception as e:
+                    logger.error(f"回收连接失败: {str(e)}")
+
+    def maybe_trim(self):
+        """限频归还内存，malloc_trim 在线程池中后台执行，不阻塞事件循环"""
+        if _malloc_trim is None or time.monotonic() - self.last_trim < TRIM_INTERVAL:
+            return
+        self.last_trim = time.monotonic()
+        asyncio.get_event_loop().run_in_executor(None, trim_memory)
@@ -2,7 +2,7 @@ import asyncio
 import threading
 import argparse
 from server import ChatServer, ServerCommands
-from api_server import app as api_app
+from api_server import app as api_app, lookup_token
 from web_server import app as web_app
 import logging
 
@@ -26,9 +26,14 @@ async def keep_alive():
     except asyncio.CancelledError:
         pass
 
-async def main(no_command=False, web_port=8002):
+async def main(no_command=False, web_port=8002, heartbeat_interval=30, heartbeat_timeout=90, archive_options=None):
     # 启动聊天服务器
-    chat_server = ChatServer()
+    chat_server = ChatServer(
+        heartbeat_interval=heartbeat_interval,
+        heartbeat_timeout=heartbeat_timeout,
+        token_verifier=lookup_token,
+        **(archive_options or {})
+    )
     server = chat_server.run()
     commands = ServerCommands(chat_server)
     
@@ -55,12 +60,14 @@ async def main(no_command=False, web_port=8002):
             # 无命令行模式，运行WebSocket服务器和保活协程
             await asyncio.gather(
                 server,
+                chat_server.run_compactor(),
                 keep_alive()
             )
         else:
             # 运行WebSocket服务器和命令行界面
             await asyncio.gather(
                 server,
+                chat_server.run_compactor(),
                 commands.handle_commands()
             )
     except KeyboardInterrupt:
@@ -74,7 +81,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='洛²聊天服务器')
     parser.add_argument('--no-command', action='store_true', help='以无命令行模式运行')
     parser.add_argument('--web-port', type=int, default=8002, help='Web服务器端口号（默认：8002）')
+    parser.add_argument('--heartbeat-interval', type=int, default=30, help='客户端心跳间隔秒数（默认：30）')
+    parser.add_argument('--heartbeat-timeout', type=int, default=90, help='心跳超时秒数，超时的连接将被回收（默认：90）')
+    parser.add_argument('--archive-after-days', type=int, default=7, help='超过该天数的消息移入压缩归档（默认：7）')
+    parser.add_argument('--archive-partition', choices=['day', 'month'], default='month', help='归档分段粒度（默认：month）')
+    parser.add_argument('--lobby-retention-days', type=int, default=None, help='大厅消息保留天数（默认：永久）')
+    parser.add_argument('--private-retention-days', type=int, default=None, help='私聊消息保留天数（默认：永久）')
     args = parser.parse_args()
+    archive_options = {
+        'archive_after_days': args.archive_after_days,
+        'archive_partition': args.archive_partition,
+        'lobby_retention_days': args.lobby_retention_days,
+        'private_retention_days': args.private_retention_days
+    }
 
     banner = """
 =================================
@@ -87,6 +106,8 @@ if __name__ == "__main__":
 可用命令:
 - users: 显示在线用户
 - count: 显示当前连接数
+- export <lobby|private> <开始日期> <结束日期> <输出文件>: 导出聊天记录
+- connections: 显示连接资源统计
 - broadcast <消息>: 发送系统广播
 - help: 显示帮助信息
 - exit: 关闭
@@ -105,9 +126,9 @@ if __name__ == "__main__":
     print(banner)
 
     try:
-        asyncio.run(main(args.no_command, args.web_port))
+        asyncio.run(main(args.no_command, args.web_port, args.heartbeat_interval, args.heartbeat_timeout, archive_options))
     except KeyboardInterrupt:
         print("\n系统已关闭")
     except EOFError:
         print("\n检测到后台运行环境，切换到无命令行模式")
-        asyncio.run(main(True, args.web_port)) 
\ No newline at end of file
+        asyncio.run(main(True, args.web_port, args.heartbeat_interval, args.heartbeat_timeout, archive_options)) 
\ No newline at end of file
@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 每个用户最多保留的离线消息数
+MAILBOX_LIMIT = 1000
+# 重新连接时每批投递的离线消息数
+MAILBOX_BATCH_SIZE = 50
+
+
+class OfflineMailbox:
+    """离线私聊消息信箱
+
+    所有私聊消息都按接收方进入信箱并分配递增序号，在线时同时直接推送。
+    重新连接后分批投递，客户端确认序号或标记已读后删除对应消息，
+    因此半开连接上未送达的消息会在下次登录时重新投递。信箱单独持久化，读写开销只与
+    待投递消息数有关，与私聊历史总量无关。
+    """
+
+    def __init__(self, mailbox_file='data/mailboxes.json', limit=MAILBOX_LIMIT, batch_size=MAILBOX_BATCH_SIZE):
+        self.mailbox_file = mailbox_file
+        self.limit = limit
+        self.batch_size = batch_size
+        self.mailboxes = {}  # {user: {"next_seq": n, "pending": [{"seq": n, "message": {...}}]}}
+        self.loaded = False
+
+    def load(self):
+        """从JSON文件加载信箱，返回文件是否存在"""
+        try:
+            if os.path.exists(self.mailbox_file):
+                with open(self.mailbox_file, 'r', encoding='utf-8') as f:
+                    self.mailboxes = json.load(f)
+                self.loaded = True
+                logger.info(f"已加载 {self.pending_total()} 条离线消息")
+        except Exception as e:
+            logger.error(f"加载离线信箱失败: {str(e)}")
+            self.mailboxes = {}
+        return self.loaded
+
+    def save(self):
+        """保存信箱到JSON文件"""
+        try:
+            os.makedirs(os.path.dirname(self.mailbox_file), exist_ok=True)
+            with open(self.mailbox_file, 'w', encoding='utf-8') as f:
+                json.dump(self.mailboxes, f, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"保存离线信箱失败: {str(e)}")
+
+    def rebuild(self, private_messages):
+        """首次启用信箱时，从私聊记录中收集尚未送达的消息"""
+        for user, conversations in private_messages.items():
+            for messages in conversations.values():
+                for msg in messages:
+                    if msg.recipient == user and msg.status == 'sent':
+                        self._append(user, msg.to_dict())
+        for box in self.mailboxes.values():
+            box['pending'].sort(key=lambda entry: entry['message'].get('timestamp', ''))
+            for seq, entry in enumerate(box['pending'], 1):
+                entry['seq'] = seq
+            box['next_seq'] = len(box['pending']) + 1
+        self.save()
+        logger.info(f"已从私聊记录重建 {self.pending_total()} 条离线消息")
+
+    def pending_total(self):
+        return sum(len(box['pending']) for box in self.mailboxes.values())
+
+    def pending_count(self, user):
+        box = self.mailboxes.get(user)
+        return len(box['pending']) if box else 0
+
+    def _append(self, user, message):
+        box = self.mailboxes.setdefault(user, {"next_seq": 1, "pending": []})
+        box['pending'].append({"seq": box['next_seq'], "message": message})
+        box['next_seq'] += 1
+        if len(box['pending']) > self.limit:
+            dropped = len(box['pending']) - self.limit
+            del box['pending'][:dropped]
+            logger.warning(f"{user} 的离线信箱已满，丢弃最早的 {dropped} 条消息")
+
+    def enqueue(self, user, message):
+        """把消息放入用户信箱"""
+        self._append(user, message)
+        self.save()
+
+    def next_batch(self, user):
+        """返回下一批待投递的消息，没有待投递消息时返回 None"""
+        box = self.mailboxes.get(user)
+        if not box or not box['pending']:
+            return None
+        entries = box['pending'][:self.batch_size]
+        return {
+            "type": "offline_batch",
+            "ack_seq": entries[-1]['seq'],
+            "remaining": len(box['pending']) - len(entries),
+            "messages": [entry['message'] for entry in entries]
+        }
+
+    def ack(self, user, seq):
+        """确认序号及之前的消息已送达并从信箱删除"""
+        box = self.mailboxes.get(user)
+        if not box:
+            return
+        pending = box['pending']
+        count = 0
+        while count < len(pending) and pending[count]['seq'] <= seq:
+            count += 1
+        if not count:
+            return
+        del pending[:count]
+        if not pending:
+            del self.mailboxes[user]
+        self.save()
+
+    def discard_from(self, user, from_user):
+        """标记已读时移除来自 from_user 的消息"""
+        box = self.mailboxes.get(user)
+        if not box:
+            return
+        before = len(box['pending'])
+        box['pending'] = [entry for entry in box['pending'] if entry['message'].get('from') != from_user]
+        if len(box['pending']) != before:
+            if not box['pending']:
+                del self.mailboxes[user]
+            self.save()
+
+    def discard(self, user, message_id):
+        """撤回时从信箱中移除尚未投递的消息"""
+        box = self.mailboxes.get(user)
+        if not box:
+            return
+        before = len(box['pending'])
+        box['pending'] = [entry for entry in box['pending'] if entry['message'].get('id') != message_id]
+        if len(box['pending']) != before:
+            if not box['pending']:
+                del self.mailboxes[user]
+            self.save()
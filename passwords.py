@@ -0,0 +1,116 @@
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# scrypt 参数: n=2^14, r=8 约占用 16 MiB 内存
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# 进程池大小，以及排队加执行中的哈希任务上限
+HASH_WORKERS = os.cpu_count() or 1
+HASH_MAX_PENDING = HASH_WORKERS * 8
+# 等待排队名额和计算结果的最长时间（秒）
+HASH_TIMEOUT = 10
+
+
+class HasherBusyError(Exception):
+    """哈希任务排队已满"""
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES)
+
+
+def hash_password(password):
+    """使用加盐的 scrypt 哈希密码，格式为 scrypt$n$r$p$盐$哈希"""
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """校验密码，兼容旧版无盐 SHA-256 哈希"""
+    if not stored:
+        return False
+    if stored.startswith('scrypt$'):
+        try:
+            _, n, r, p, salt, digest = stored.split('$')
+            candidate = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(candidate.hex(), digest)
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(legacy, stored)
+
+
+def needs_rehash(stored):
+    """旧格式或参数低于当前设置的哈希需要在登录时升级"""
+    if not stored or not stored.startswith('scrypt$'):
+        return True
+    try:
+        _, n, r, p, _, _ = stored.split('$')
+        return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    except ValueError:
+        return True
+
+
+class PasswordHasher:
+    """在进程池中计算密码哈希
+
+    哈希计算不占用 Flask 请求线程和聊天服务器所在进程的 GIL。
+    排队加执行中的任务数有上限，超过上限或等待结果超时时抛出 HasherBusyError。
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # 主进程中已有事件循环和多个线程，使用 spawn 避免 fork 带来的问题
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.pool
+
+    def _run(self, func, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HasherBusyError("密码哈希任务排队已满")
+        try:
+            future = self._get_pool().submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # 任务真正结束（完成、失败或取消）后才归还名额，超时放弃等待的任务仍占用名额
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            future.cancel()
+            raise HasherBusyError("密码哈希超时")
+
+    def hash(self, password):
+        return self._run(hash_password, password)
+
+    def verify(self, password, stored):
+        return self._run(verify_password, password, stored)
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
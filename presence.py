@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 在线状态变化的最短推送间隔（秒）
+PRESENCE_FLUSH_INTERVAL = 1.0
+
+
+class PresenceService:
+    """在线状态服务
+
+    在线集合由连接注册表维护（同一用户可以有多个连接），上下线变化先合并到
+    待推送的差量中，再以不超过 flush_interval 的频率推送给所有已登录连接。
+    在线状态事件不写入聊天记录。
+    """
+
+    def __init__(self, chat_server, flush_interval=PRESENCE_FLUSH_INTERVAL):
+        self.chat_server = chat_server
+        self.flush_interval = flush_interval
+        self.connections = {}  # {username: 连接数}
+        self.pending = {}  # {username: True上线 / False下线}
+        self.flush_task = None
+
+    def online_users(self):
+        """返回当前在线用户列表"""
+        return list(self.connections)
+
+    def is_online(self, username):
+        return username in self.connections
+
+    def snapshot(self):
+        """登录时发送的完整在线列表"""
+        return {
+            "type": "presence_snapshot",
+            "users": self.online_users()
+        }
+
+    def user_connected(self, username):
+        """记录一个已登录连接，首个连接时产生上线事件"""
+        count = self.connections.get(username, 0)
+        self.connections[username] = count + 1
+        if count == 0:
+            self._record(username, True)
+
+    def user_disconnected(self, username):
+        """移除一个已登录连接，最后一个连接断开时产生下线事件"""
+        count = self.connections.get(username, 0)
+        if count <= 1:
+            self.connections.pop(username, None)
+            if count == 1:
+                self._record(username, False)
+        else:
+            self.connections[username] = count - 1
+
+    def _record(self, username, online):
+        # 同一推送周期内先上线后下线（或反之）的变化相互抵消
+        if self.pending.get(username) is (not online):
+            del self.pending[username]
+        else:
+            self.pending[username] = online
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """推送合并后的在线状态差量"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        message = {
+            "type": "presence",
+            "joined": [user for user, online in pending.items() if online],
+            "left": [user for user, online in pending.items() if not online]
+        }
+        await self.chat_server.broadcast(message, recipients=list(self.chat_server.users))
@@ -0,0 +1,162 @@
+import calendar
+import json
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+# 线路编码格式，在 login 时按连接协商，默认使用 JSON
+ENCODING_JSON = 'json'
+ENCODING_COMPACT = 'compact'
+SUPPORTED_ENCODINGS = (ENCODING_JSON, ENCODING_COMPACT)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 紧凑编码的消息结构: 类型码 -> (消息类型, 字段列表)
+# 类型码 0 保留给无法按结构编码的消息，整体以 JSON 文本携带
+COMPACT_FALLBACK = 0
+COMPACT_SCHEMAS = {
+    1: ('chat', ('username', 'content')),
+    2: ('system', ('content', 'message_id')),
+    3: ('private', ('id', 'from', 'to', 'content', 'status')),
+}
+COMPACT_CODES = {name: (code, fields) for code, (name, fields) in COMPACT_SCHEMAS.items()}
+
+
+@lru_cache(maxsize=4096)
+def timestamp_to_ms(timestamp):
+    """把 "%Y-%m-%d %H:%M:%S" 格式的时间字符串转换为毫秒时间戳
+
+    同一秒内的消息共享时间字符串，缓存可以省去重复的 strptime 解析。
+    """
+    return int(datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp() * 1000)
+
+
+@lru_cache(maxsize=256)
+def _utc_offset(hour):
+    """UTC 第 hour 个整点开始的一小时内本地时间的偏移（秒），这一小时内偏移变化时返回 None"""
+    start = hour * 3600
+    offsets = {calendar.timegm(time.localtime(second)) - second for second in (start, start + 3599)}
+    return offsets.pop() if len(offsets) == 1 else None
+
+
+@lru_cache(maxsize=256)
+def _date_prefix(day):
+    return time.strftime('%Y-%m-%d ', time.gmtime(day * 86400))
+
+
+def ms_to_timestamp(ms):
+    """把毫秒时间戳转换回 "%Y-%m-%d %H:%M:%S" 格式
+
+    保存聊天记录时每条消息都要格式化一次。时区偏移按小时、日期按天缓存，
+    按时间顺序格式化时每小时只查询一次本地时间，其余只做整数运算。
+    """
+    second = ms // 1000
+    offset = _utc_offset(second // 3600)
+    if offset is None:
+        return '%04d-%02d-%02d %02d:%02d:%02d' % time.localtime(second)[:6]
+    day, rest = divmod(second + offset, 86400)
+    hour, rest = divmod(rest, 3600)
+    minute, sec = divmod(rest, 60)
+    return '%s%02d:%02d:%02d' % (_date_prefix(day), hour, minute, sec)
+
+
+# 紧凑帧中的时间戳按固定的 UTC 偏移编码服务器给出的时间字符串（不做时区换算），
+# 客户端同样按 UTC 还原，保证与 JSON 连接看到的时间字符串完全一致
+WIRE_EPOCH = datetime(1970, 1, 1)
+
+
+@lru_cache(maxsize=4096)
+def _wire_ms(timestamp):
+    return calendar.timegm(datetime.strptime(timestamp, TIMESTAMP_FORMAT).timetuple()) * 1000
+
+
+def _wire_timestamp(ms):
+    return (WIRE_EPOCH + timedelta(milliseconds=ms)).strftime(TIMESTAMP_FORMAT)
+
+
+def _write_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_compact(message):
+    """把消息编码为紧凑二进制帧
+
+    帧格式: 类型码(1字节) + 毫秒时间戳(varint, 按 UTC 编码的时间字符串, 0表示无) + 事件序号(varint, 0表示无)
+    + 按结构排列的字段,
+    每个字段为 varint(长度+1, 0表示空值) + UTF-8 内容。
+    含有结构之外字段的消息使用类型码 0，以 JSON 文本携带，保证无损。
+    """
+    schema = COMPACT_CODES.get(message.get('type'))
+    timestamp = message.get('timestamp')
+    if schema is not None:
+        code, fields = schema
+        if any(key not in fields and key not in ('type', 'timestamp', 'seq') for key in message):
+            schema = None
+    if schema is not None and timestamp is not None:
+        try:
+            ts_ms = _wire_ms(timestamp)
+        except (TypeError, ValueError):
+            schema = None
+
+    buf = bytearray()
+    if schema is None:
+        buf.append(COMPACT_FALLBACK)
+        buf += json.dumps(message, ensure_ascii=False).encode('utf-8')
+        return bytes(buf)
+
+    buf.append(code)
+    _write_varint(buf, ts_ms if timestamp is not None else 0)
+    _write_varint(buf, message.get('seq') or 0)
+    for field in fields:
+        value = message.get(field)
+        if value is None:
+            buf.append(0)
+            continue
+        raw = str(value).encode('utf-8')
+        _write_varint(buf, len(raw) + 1)
+        buf += raw
+    return bytes(buf)
+
+
+def decode_compact(data):
+    """解码紧凑二进制帧，返回消息字典"""
+    code = data[0]
+    if code == COMPACT_FALLBACK:
+        return json.loads(data[1:].decode('utf-8'))
+    name, fields = COMPACT_SCHEMAS[code]
+    message = {'type': name}
+    ts_ms, pos = _read_varint(data, 1)
+    seq, pos = _read_varint(data, pos)
+    for field in fields:
+        length, pos = _read_varint(data, pos)
+        if length == 0:
+            continue
+        message[field] = data[pos:pos + length - 1].decode('utf-8')
+        pos += length - 1
+    if ts_ms:
+        message['timestamp'] = _wire_timestamp(ts_ms)
+    if seq:
+        message['seq'] = seq
+    return message
+
+
+def encode_message(message, encoding=ENCODING_JSON):
+    """按连接协商的编码格式序列化消息"""
+    if encoding == ENCODING_COMPACT:
+        return encode_compact(message)
+    return json.dumps(message)
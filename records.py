@@ -0,0 +1,120 @@
+import sys
+import time
+import uuid
+
+from protocol import ms_to_timestamp, timestamp_to_ms
+
+# 字典格式中的字段名 -> 记录中的属性名
+_FIELD_SLOTS = {
+    'username': 'sender',
+    'from': 'sender',
+    'to': 'recipient',
+    'content': 'content',
+    'status': 'status',
+}
+
+
+def now_ms():
+    """当前时间的毫秒时间戳"""
+    return int(time.time() * 1000)
+
+
+def parse_message_id(message_id):
+    """把字符串形式的消息ID转换为记录中保存的16字节形式，无法解析时原样返回"""
+    try:
+        return uuid.UUID(message_id).bytes
+    except (TypeError, ValueError, AttributeError):
+        return message_id
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class MessageRecord:
+    """内存中的聊天消息
+
+    用户名经过驻留共享，时间为毫秒整数，私聊消息ID保存为16字节，
+    只在发送和持久化时通过 to_dict 转换为原有的字典格式。
+    """
+    __slots__ = ('type', 'sender', 'recipient', 'content', 'ts', 'id', 'status', 'extra')
+
+    def __init__(self, type, content, sender=None, recipient=None, ts=None, id=None, status=None, extra=None):
+        self.type = _intern(type)
+        self.sender = _intern(sender)
+        self.recipient = _intern(recipient)
+        self.content = content
+        self.ts = now_ms() if ts is None else ts  # 从字典创建时可能为 None，表示没有时间
+        self.id = id
+        self.status = _intern(status)
+        self.extra = extra  # 很少出现的字段，如 read_at、recall_at
+
+    @classmethod
+    def chat(cls, username, content):
+        return cls('chat', content, sender=username)
+
+    @classmethod
+    def system(cls, content):
+        return cls('system', content)
+
+    @classmethod
+    def private(cls, from_user, to_user, content):
+        return cls('private', content, sender=from_user, recipient=to_user, id=uuid.uuid4().bytes, status='sent')
+
+    @property
+    def message_id(self):
+        """字符串形式的消息ID"""
+        if isinstance(self.id, bytes):
+            return str(uuid.UUID(bytes=self.id))
+        return self.id
+
+    @property
+    def timestamp(self):
+        return ms_to_timestamp(self.ts) if self.ts is not None else None
+
+    def set_extra(self, key, value):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def to_dict(self):
+        """转换为发送和持久化使用的字典格式"""
+        message = {"type": self.type}
+        if self.type == 'private':
+            message["from"] = self.sender
+            message["to"] = self.recipient
+        elif self.sender is not None:
+            message["username"] = self.sender
+        message["content"] = self.content
+        if self.ts is not None:
+            message["timestamp"] = ms_to_timestamp(self.ts)
+        if self.id is not None:
+            message["id"] = self.message_id
+        if self.status is not None:
+            message["status"] = self.status
+        if self.extra:
+            message.update(self.extra)
+        return message
+
+    @classmethod
+    def from_dict(cls, message):
+        """从字典格式创建记录，没有可解析时间的消息 ts 为 None"""
+        record = cls(message.get('type'), None)
+        record.ts = None
+        for key, value in message.items():
+            if key == 'type':
+                continue
+            if key == 'timestamp':
+                try:
+                    record.ts = timestamp_to_ms(value)
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            elif key == 'id':
+                record.id = parse_message_id(value)
+                continue
+            elif key in _FIELD_SLOTS:
+                setattr(record, _FIELD_SLOTS[key], _intern(value))
+                continue
+            record.set_extra(key, value)
+        return record
@@ -0,0 +1,107 @@
+import logging
+import secrets
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 每个会话保留的可重放事件数
+REPLAY_BUFFER_SIZE = 500
+# 连接断开后会话保留的时间（秒），超时后只能重新登录
+RESUME_WINDOW = 120
+
+# 不分配序号、不进入重放缓冲的消息: 控制消息在恢复会话时重新生成，瞬时事件直接丢弃
+UNSEQUENCED_TYPES = frozenset({
+    'pong', 'heartbeat', 'session', 'resumed', 'resume_failed',
+    'presence_snapshot', 'offline_batch', 'typing'
+})
+
+
+class ResumeSession:
+    """可恢复的会话，缓存最近发给该用户的事件"""
+
+    def __init__(self, username, websocket, buffer_size=REPLAY_BUFFER_SIZE):
+        self.session_id = secrets.token_urlsafe(16)
+        self.username = username
+        self.websocket = websocket
+        self.detached_at = None
+        self.buffer = deque(maxlen=buffer_size)  # [(seq, message)]
+        self.evicted_seq = 0  # 已被挤出缓冲的最大序号
+
+    def record(self, seq, message):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.evicted_seq = self.buffer[0][0]
+        self.buffer.append((seq, message))
+
+    def can_resume(self, last_seq):
+        """缓冲中仍包含 last_seq 之后的全部事件时才能恢复"""
+        return last_seq >= self.evicted_seq
+
+    def replay(self, last_seq):
+        return [message for seq, message in self.buffer if seq > last_seq]
+
+
+class SessionRegistry:
+    """管理可恢复会话"""
+
+    def __init__(self, buffer_size=REPLAY_BUFFER_SIZE, resume_window=RESUME_WINDOW):
+        self.buffer_size = buffer_size
+        self.resume_window = resume_window
+        self.sessions = {}  # {session_id: ResumeSession}
+        self.by_websocket = {}  # {websocket: ResumeSession}
+
+    def create(self, username, websocket):
+        """登录成功后为连接创建新会话"""
+        self.drop(websocket)
+        self.prune()
+        session = ResumeSession(username, websocket, self.buffer_size)
+        self.sessions[session.session_id] = session
+        self.by_websocket[websocket] = session
+        return session
+
+    def get(self, websocket):
+        return self.by_websocket.get(websocket)
+
+    def drop(self, websocket):
+        session = self.by_websocket.pop(websocket, None)
+        if session is not None:
+            self.sessions.pop(session.session_id, None)
+
+    def detach(self, websocket):
+        """连接断开，会话在恢复窗口内保留"""
+        session = self.by_websocket.pop(websocket, None)
+        if session is not None:
+            session.websocket = None
+            session.detached_at = time.monotonic()
+        self.prune()
+
+    def detached(self):
+        return [session for session in self.sessions.values() if session.websocket is None]
+
+    def resume(self, session_id, last_seq, websocket, username):
+        """把会话接到新连接上，会话不属于 username 或无法恢复时返回 None"""
+        session = self.sessions.get(session_id)
+        if session is None or session.username != username:
+            return None
+        if not isinstance(last_seq, int) or not session.can_resume(last_seq):
+            return None
+        if session.websocket is not None:
+            # 旧连接尚未被回收，由新连接接管
+            self.by_websocket.pop(session.websocket, None)
+        self.drop(websocket)
+        session.websocket = websocket
+        session.detached_at = None
+        self.by_websocket[websocket] = session
+        return session
+
+    def prune(self):
+        """删除超过恢复窗口的会话"""
+        deadline = time.monotonic() - self.resume_window
+        expired = [
+            session_id for session_id, session in self.sessions.items()
+            if session.detached_at is not None and session.detached_at < deadline
+        ]
+        for session_id in expired:
+            del self.sessions[session_id]
+        if expired:
+            logger.info(f"清理 {len(expired)} 个过期会话")
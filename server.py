@@ -5,31 +5,70 @@ import logging
 from datetime import datetime
 import os
 import requests
-import uuid
+from records import MessageRecord, now_ms, parse_message_id
+from archive import ARCHIVE_AFTER_DAYS, HistoryArchive, parse_date_range
+from protocol import ENCODING_JSON, SUPPORTED_ENCODINGS, encode_message
+from presence import PresenceService
+from ephemeral import EphemeralChannel
+from blocks import BlockIndex
+from offline_mailbox import OfflineMailbox
+from resume import UNSEQUENCED_TYPES, SessionRegistry
+from heartbeat import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, ConnectionStats, HeartbeatMonitor, process_rss
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 归档压缩任务的运行间隔（秒）
+COMPACT_INTERVAL = 3600
+# 登录和打开私聊时发送的最近消息条数，归档时每个列表至少保留这么多条在热数据中
+HISTORY_WINDOW = 50
+
 class ChatServer:
-    def __init__(self):
+    def __init__(self, heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                 archive_after_days=ARCHIVE_AFTER_DAYS, archive_partition='month',
+                 lobby_retention_days=None, private_retention_days=None, token_verifier=None):
         self.clients = set()
         self.users = {}  # websocket: username
+        self.encodings = {}  # websocket: 线路编码格式
+        self.write_tails = {}  # websocket: 最后一个排队的写入任务
+        self.connection_stats = {}  # websocket: ConnectionStats
+        self.heartbeat = HeartbeatMonitor(
+            self.reap_connection,
+            interval=heartbeat_interval,
+            timeout=heartbeat_timeout
+        )
         self.messages_history = []
         self.private_messages = {}  # {user1: {user2: [messages]}}
         self.messages_file = 'data/messages.json'
         self.private_messages_file = 'data/private_messages.json'
-        self.blocked_users = {}  # {user: [blocked_users]}
+        self.blocks = BlockIndex()
         self.unread_messages = {}  # {user: {from_user: count}}
         self.message_status = {}  # {message_id: {status, timestamp}}
+        self.presence = PresenceService(self)
+        self.ephemeral = EphemeralChannel(self)
+        self.sessions = SessionRegistry()
+        self.seq = 0  # 出站事件序号
         self.load_messages()
         self.load_private_messages()
+        self.blocks.load()
+        self.mailbox = OfflineMailbox()
+        if not self.mailbox.load():
+            self.mailbox.rebuild(self.private_messages)
+        self.archive_after_days = archive_after_days
+        self.archive = HistoryArchive(
+            partition=archive_partition,
+            retention_days={'lobby': lobby_retention_days, 'private': private_retention_days}
+        )
+        self.compacting = False
+        # 与 API 服务器同进程时直接查询共享的会话存储，否则通过 HTTP 验证
+        self.token_verifier = token_verifier
         
     def load_messages(self):
         """从JSON文件加载聊天记录"""
         try:
             if os.path.exists(self.messages_file):
                 with open(self.messages_file, 'r', encoding='utf-8') as f:
-                    self.messages_history = json.load(f)
+                    self.messages_history = [MessageRecord.from_dict(msg) for msg in json.load(f)]
                 logger.info(f"已加载 {len(self.messages_history)} 条历史消息")
         except Exception as e:
             logger.error(f"加载聊天记录失败: {str(e)}")
@@ -41,7 +80,7 @@ class ChatServer:
             # 确保目录存在
             os.makedirs(os.path.dirname(self.messages_file), exist_ok=True)
             with open(self.messages_file, 'w', encoding='utf-8') as f:
-                json.dump(self.messages_history, f, ensure_ascii=False, indent=2)
+                json.dump([msg.to_dict() for msg in self.messages_history], f, ensure_ascii=False, indent=2)
             logger.info(f"已保存 {len(self.messages_history)} 条消息")
         except Exception as e:
             logger.error(f"保存聊天记录失败: {str(e)}")
@@ -51,7 +90,22 @@ class ChatServer:
         try:
             if os.path.exists(self.private_messages_file):
                 with open(self.private_messages_file, 'r', encoding='utf-8') as f:
-                    self.private_messages = json.load(f)
+                    data = json.load(f)
+                # 同一条消息在双方记录中各存一份，加载时按ID合并为同一个记录
+                records_by_id = {}
+                self.private_messages = {}
+                for user, conversations in data.items():
+                    self.private_messages[user] = {}
+                    for other_user, messages in conversations.items():
+                        records = []
+                        for msg in messages:
+                            record = records_by_id.get(msg.get('id'))
+                            if record is None:
+                                record = MessageRecord.from_dict(msg)
+                                if record.id is not None:
+                                    records_by_id[msg['id']] = record
+                            records.append(record)
+                        self.private_messages[user][other_user] = records
                 logger.info(f"已加载私聊记录")
         except Exception as e:
             logger.error(f"加载私聊记录失败: {str(e)}")
@@ -62,12 +116,124 @@ class ChatServer:
         try:
             os.makedirs(os.path.dirname(self.private_messages_file), exist_ok=True)
             with open(self.private_messages_file, 'w', encoding='utf-8') as f:
-                json.dump(self.private_messages, f, ensure_ascii=False, indent=2)
+                data = {
+                    user: {
+                        other_user: [msg.to_dict() for msg in messages]
+                        for other_user, messages in conversations.items()
+                    }
+                    for user, conversations in self.private_messages.items()
+                }
+                json.dump(data, f, ensure_ascii=False, indent=2)
             logger.info("已保存私聊记录")
         except Exception as e:
             logger.error(f"保存私聊记录失败: {str(e)}")
 
-    def add_private_message(self, from_user, to_user, message):
+    def _archive_cutoff(self, kind):
+        """热数据保留的最早时间，保留期限更短时以保留期限为准"""
+        days = self.archive_after_days
+        retention = self.archive.retention_days.get(kind)
+        if retention is not None:
+            days = min(days, retention)
+        return now_ms() - days * 86400 * 1000
+
+    def private_records(self):
+        """返回所有私聊记录，每条消息只出现一次"""
+        seen = set()
+        records = []
+        for user, conversations in self.private_messages.items():
+            for messages in conversations.values():
+                for msg in messages:
+                    if msg.sender == user and id(msg) not in seen:
+                        seen.add(id(msg))
+                        records.append(msg)
+        return records
+
+    async def compact_history(self):
+        """把超过热数据期限的消息移入归档分段，并删除过期分段
+
+        事件循环上只挑选要归档的消息，序列化、压缩和文件操作都在线程池中进行，
+        写入归档成功后才从热数据中移除。
+        """
+        if self.compacting:
+            return
+        self.compacting = True
+        try:
+            # 消息按时间顺序追加，只需检查每个列表开头的旧消息；最近 HISTORY_WINDOW 条
+            # 始终保留，客户端仍能看到；没有时间的旧消息无法归入分段，同样保留
+            cutoff = self._archive_cutoff('lobby')
+            lobby_count = 0
+            for msg in self.messages_history[:-HISTORY_WINDOW]:
+                if msg.ts is not None and msg.ts >= cutoff:
+                    break
+                lobby_count += 1
+            lobby_prefix = self.messages_history[:lobby_count]
+            lobby_old = [msg for msg in lobby_prefix if msg.ts is not None]
+
+            cutoff = self._archive_cutoff('private')
+            private_counts = {}
+            private_old = []
+            seen = set()
+            for user, conversations in self.private_messages.items():
+                for other_user, messages in conversations.items():
+                    count = 0
+                    timed = False
+                    for msg in messages[:-HISTORY_WINDOW]:
+                        if msg.ts is not None and msg.ts >= cutoff:
+                            break
+                        count += 1
+                        if msg.ts is None:
+                            continue
+                        timed = True
+                        if msg.sender == user and id(msg) not in seen:
+                            seen.add(id(msg))
+                            private_old.append(msg)
+                    if timed:
+                        private_counts[(user, other_user)] = count
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_archive, lobby_old, private_old)
+
+            if lobby_old:
+                self.messages_history[:lobby_count] = [msg for msg in lobby_prefix if msg.ts is None]
+                self.save_messages()
+            if private_counts:
+                for (user, other_user), count in private_counts.items():
+                    messages = self.private_messages[user][other_user]
+                    messages[:count] = [msg for msg in messages[:count] if msg.ts is None]
+                    if not messages:
+                        del self.private_messages[user][other_user]
+                self.private_messages = {user: conv for user, conv in self.private_messages.items() if conv}
+                self.save_private_messages()
+        finally:
+            self.compacting = False
+
+    def _write_archive(self, lobby_old, private_old):
+        """在线程池中写入归档分段并执行保留策略"""
+        self.archive.write('lobby', lobby_old)
+        self.archive.write('private', private_old)
+        self.archive.apply_retention()
+
+    async def run_compactor(self, interval=COMPACT_INTERVAL):
+        """后台定期归档聊天记录"""
+        while True:
+            try:
+                await self.compact_history()
+            except Exception as e:
+                logger.error(f"归档聊天记录失败: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def export_history(self, kind, start, end, output_file):
+        """把日期范围内的聊天记录流式导出为 JSON Lines，返回导出条数"""
+        start_dt, end_dt = parse_date_range(start, end)
+        hot_messages = list(self.messages_history) if kind == 'lobby' else self.private_records()
+
+        def write():
+            with open(output_file, 'w', encoding='utf-8') as out:
+                return self.archive.export(kind, start_dt, end_dt, out, hot_messages)
+
+        return await asyncio.get_running_loop().run_in_executor(None, write)
+
+    def add_private_message(self, from_user, to_user, content):
         """添加私聊消息"""
         if from_user not in self.private_messages:
             self.private_messages[from_user] = {}
@@ -80,11 +246,7 @@ class ChatServer:
         if from_user not in self.private_messages[to_user]:
             self.private_messages[to_user][from_user] = []
             
-        message_with_id = {
-            **message,
-            'id': str(uuid.uuid4()),
-            'status': 'sent'
-        }
+        message_with_id = MessageRecord.private(from_user, to_user, content)
         
         self.private_messages[from_user][to_user].append(message_with_id)
         self.private_messages[to_user][from_user].append(message_with_id)
@@ -101,19 +263,15 @@ class ChatServer:
 
     def is_user_blocked(self, from_user, to_user):
         """检查用户是否被屏蔽"""
-        return to_user in self.blocked_users.get(from_user, [])
+        return self.blocks.is_blocked(from_user, to_user)
 
     def block_user(self, user, blocked_user):
         """屏蔽用户"""
-        if user not in self.blocked_users:
-            self.blocked_users[user] = []
-        if blocked_user not in self.blocked_users[user]:
-            self.blocked_users[user].append(blocked_user)
+        self.blocks.block(user, blocked_user)
 
     def unblock_user(self, user, blocked_user):
         """取消屏蔽用户"""
-        if user in self.blocked_users and blocked_user in self.blocked_users[user]:
-            self.blocked_users[user].remove(blocked_user)
+        self.blocks.unblock(user, blocked_user)
 
     async def mark_messages_as_read(self, user, from_user):
         """标记消息为已读"""
@@ -123,24 +281,26 @@ class ChatServer:
         # 更新消息状态
         if user in self.private_messages and from_user in self.private_messages[user]:
             for msg in self.private_messages[user][from_user]:
-                if msg['status'] == 'sent':
-                    msg['status'] = 'read'
-                    msg['read_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if msg.status == 'sent':
+                    msg.status = 'read'
+                    msg.set_extra('read_at', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
             
         self.save_private_messages()
+        self.mailbox.discard_from(user, from_user)
 
     async def recall_message(self, message_id, user):
         """撤回消息"""
         recalled_message = None
         target_users = set()
+        record_id = parse_message_id(message_id)
         
         # 查找消息并标记为已撤回
         for from_user in self.private_messages:
             for to_user in self.private_messages[from_user]:
                 for msg in self.private_messages[from_user][to_user]:
-                    if msg.get('id') == message_id and msg.get('from') == user:
-                        msg['status'] = 'recalled'
-                        msg['recall_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    if msg.id == record_id and msg.sender == user:
+                        msg.status = 'recalled'
+                        msg.set_extra('recall_at', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
                         recalled_message = msg
                         target_users.add(from_user)
                         target_users.add(to_user)
@@ -152,6 +312,7 @@ class ChatServer:
                     
         if recalled_message:
             self.save_private_messages()
+            self.mailbox.discard(recalled_message.recipient, recalled_message.message_id)
             
             # 通知相关用户消息已撤回
             recall_notice = {
@@ -164,7 +325,7 @@ class ChatServer:
             # 发送通知给所有相关用户
             for ws, username in self.users.items():
                 if username in target_users:
-                    await ws.send(json.dumps(recall_notice))
+                    await self.send_message(ws, recall_notice)
             
             return True
         return False
@@ -180,28 +341,152 @@ class ChatServer:
 
     async def register(self, websocket):
         self.clients.add(websocket)
+        self.connection_stats[websocket] = ConnectionStats()
+        self.heartbeat.touch(websocket)
+        self.heartbeat.start()
         logger.info(f"新客户端连接。当前连接数: {len(self.clients)}")
         
     async def unregister(self, websocket):
+        if websocket not in self.clients:
+            return  # 已被心跳检测回收
         self.clients.remove(websocket)
+        self.encodings.pop(websocket, None)
+        self.connection_stats.pop(websocket, None)
+        self.heartbeat.remove(websocket)
         if websocket in self.users:
             username = self.users[websocket]
             del self.users[websocket]
-            system_message = {
-                "type": "system",
-                "content": f"{username} 离开了聊天室",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            self.messages_history.append(system_message)
-            await self.broadcast(system_message)
-            self.save_messages()
+            self.presence.user_disconnected(username)
+            self.sessions.detach(websocket)
         logger.info(f"客户端断开连接。当前连接数: {len(self.clients)}")
+        # 正常断开和心跳回收都经过这里，限频归还断开连接释放的内存
+        self.heartbeat.maybe_trim()
         
-    async def broadcast(self, message):
-        if self.clients:
-            await asyncio.gather(
-                *[client.send(json.dumps(message)) for client in self.clients]
-            )
+    async def reap_connection(self, websocket):
+        """回收心跳超时的连接"""
+        await self.unregister(websocket)
+        # 半开连接的关闭握手可能要等到 close_timeout，放到后台进行
+        asyncio.ensure_future(websocket.close(1011, "heartbeat timeout"))
+        
+    def connection_footprint(self, websocket):
+        """返回连接当前占用的缓冲：(传输层写缓冲字节数, 排队待写消息数, 重放缓冲事件数)"""
+        transport = getattr(websocket, 'transport', None)
+        write_buffer = transport.get_write_buffer_size() if transport is not None else 0
+        stats = self.connection_stats.get(websocket)
+        pending = stats.pending_writes if stats is not None else 0
+        session = self.sessions.get(websocket)
+        replay = len(session.buffer) if session is not None else 0
+        return write_buffer, pending, replay
+
+    def connection_summary(self):
+        """汇总所有连接的资源统计
+
+        收发字节数是累计流量，连接当前占用的内存看写缓冲、待写消息和重放缓冲。
+        """
+        stats = list(self.connection_stats.values())
+        footprints = [self.connection_footprint(websocket) for websocket in self.connection_stats]
+        detached = self.sessions.detached()
+        return {
+            "connections": len(stats),
+            "bytes_in": sum(s.bytes_in for s in stats),
+            "bytes_out": sum(s.bytes_out for s in stats),
+            "messages_in": sum(s.messages_in for s in stats),
+            "messages_out": sum(s.messages_out for s in stats),
+            "write_buffer": sum(f[0] for f in footprints),
+            "max_write_buffer": max((f[0] for f in footprints), default=0),
+            "pending_writes": sum(f[1] for f in footprints),
+            "replay_buffered": sum(f[2] for f in footprints),
+            "detached_sessions": len(detached),
+            "detached_buffered": sum(len(session.buffer) for session in detached),
+            "rss": process_rss()
+        }
+        
+    def stamp(self, message):
+        """为出站事件分配递增序号，控制消息不分配"""
+        if isinstance(message, MessageRecord):
+            message = message.to_dict()
+        if message.get("type") in UNSEQUENCED_TYPES:
+            return message
+        self.seq += 1
+        return {**message, "seq": self.seq}
+        
+    async def send_message(self, websocket, message):
+        """为消息分配序号、记入会话重放缓冲后发送"""
+        message = self.stamp(message)
+        session = self.sessions.get(websocket)
+        if session is not None and "seq" in message:
+            session.record(message["seq"], message)
+        await self.send_raw(websocket, message)
+        
+    async def send_raw(self, websocket, message):
+        """按连接协商的编码格式发送消息"""
+        encoding = self.encodings.get(websocket, ENCODING_JSON)
+        payload = encode_message(message, encoding)
+        stats = self.connection_stats.get(websocket)
+        if stats is not None:
+            stats.record_out(len(payload))
+        await self.write(websocket, payload)
+
+    def write(self, websocket, payload):
+        """排队写入连接，返回写入任务
+
+        同一连接的写入按调用顺序依次进行。序号在调用时分配，因此客户端
+        收到的事件序号始终递增，广播的并发发送不会被后来的单发消息超过。
+        """
+        previous = self.write_tails.get(websocket)
+        task = asyncio.ensure_future(self._write_after(previous, websocket, payload))
+        self.write_tails[websocket] = task
+        stats = self.connection_stats.get(websocket)
+        if stats is not None:
+            stats.pending_writes += 1
+        task.add_done_callback(lambda done: self._release_tail(websocket, done, stats))
+        return task
+
+    async def _write_after(self, previous, websocket, payload):
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        await websocket.send(payload)
+
+    def _release_tail(self, websocket, task, stats):
+        if stats is not None:
+            stats.pending_writes -= 1
+        if self.write_tails.get(websocket) is task:
+            del self.write_tails[websocket]
+
+    async def broadcast(self, message, recipients=None, sender=None):
+        """广播消息，recipients 为空时发送给所有连接
+
+        指定 sender 时跳过屏蔽了发送者的接收者，只需查询一次发送者的屏蔽者集合。
+        """
+        message = self.stamp(message)
+        sequenced = "seq" in message
+        blockers = self.blocks.blockers_of(sender) if sender is not None else ()
+        if recipients is None:
+            recipients = self.clients
+            # 大厅事件同时记入已断开但仍可恢复的会话
+            if sequenced:
+                for session in self.sessions.detached():
+                    if session.username not in blockers:
+                        session.record(message["seq"], message)
+        if recipients:
+            # 每种编码格式只序列化一次，由同格式的接收者共享
+            payloads = {}
+            sends = []
+            for client in recipients:
+                if blockers and self.users.get(client) in blockers:
+                    continue
+                encoding = self.encodings.get(client, ENCODING_JSON)
+                if encoding not in payloads:
+                    payloads[encoding] = encode_message(message, encoding)
+                stats = self.connection_stats.get(client)
+                if stats is not None:
+                    stats.record_out(len(payloads[encoding]))
+                session = self.sessions.get(client)
+                if session is not None and sequenced:
+                    session.record(message["seq"], message)
+                sends.append(self.write(client, payloads[encoding]))
+            # 单个连接发送失败（如已断开）不影响其他接收者
+            await asyncio.gather(*sends, return_exceptions=True)
             
     async def send_private_message(self, from_username, to_username, content):
         """发送私聊消息"""
@@ -212,17 +497,12 @@ class ChatServer:
         # 过滤敏感词
         filtered_content = self.filter_sensitive_words(content)
         
-        # 创建消息对象
-        private_message = {
-            "type": "private",
-            "from": from_username,
-            "to": to_username,
-            "content": filtered_content,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
         # 保存消息并获取带ID的消息
-        message_with_id = self.add_private_message(from_username, to_username, private_message)
+        message_with_id = self.add_private_message(from_username, to_username, filtered_content)
+        
+        # 私聊消息都先进入接收方信箱，客户端确认或标记已读后删除，
+        # 在线推送因半开连接等原因未送达时，下次登录会重新投递
+        self.mailbox.enqueue(to_username, message_with_id.to_dict())
         
         # 查找目标用户的websocket
         target_ws = None
@@ -235,17 +515,57 @@ class ChatServer:
                 
         if target_ws:
             # 发送给接收者
-            await target_ws.send(json.dumps(message_with_id))
+            await self.send_message(target_ws, message_with_id)
             # 发送给发送者
             if sender_ws and sender_ws != target_ws:
-                await sender_ws.send(json.dumps(message_with_id))
+                await self.send_message(sender_ws, message_with_id)
             return True, "消息已发送"
         else:
-            # 用户离线，消息已存储
+            # 用户离线，重新连接后从信箱投递
             return True, "消息已存储，对方离线"
             
+    async def attach_user(self, websocket, username, encoding, session, replay=None):
+        """把已认证的用户绑定到连接，并发送会话、心跳和在线状态信息
+
+        恢复会话时 replay 为需要重放的事件，在在线用户快照之前发送，
+        使快照覆盖重放中过时的在线状态变化。
+        """
+        if websocket in self.users:
+            self.presence.user_disconnected(self.users[websocket])
+        self.users[websocket] = username
+        
+        # 协商线路编码格式，不支持的格式回退到JSON
+        if encoding not in SUPPORTED_ENCODINGS:
+            encoding = ENCODING_JSON
+        self.encodings[websocket] = encoding
+        
+        await self.send_message(websocket, {
+            "type": "session" if replay is None else "resumed",
+            "session_id": session.session_id
+        })
+        for event in replay or ():
+            await self.send_raw(websocket, event)
+        
+        # 告知客户端心跳间隔
+        await self.send_message(websocket, {
+            "type": "heartbeat",
+            "interval": self.heartbeat.interval
+        })
+        
+        # 更新在线状态并发送在线用户快照，上线通知由在线状态服务合并推送
+        self.presence.user_connected(username)
+        await self.send_message(websocket, self.presence.snapshot())
+        
+    async def send_offline_batch(self, websocket, username):
+        """发送下一批离线消息"""
+        batch = self.mailbox.next_batch(username)
+        if batch:
+            await self.send_message(websocket, batch)
+            
     async def verify_token(self, token):
         """验证用户令牌"""
+        if self.token_verifier is not None:
+            return self.token_verifier(token)
         try:
             response = requests.get(
                 'http://localhost:8001/api/user/info',
@@ -262,42 +582,58 @@ class ChatServer:
         """加载两个用户之间的私聊历史"""
         messages = []
         if user1 in self.private_messages and user2 in self.private_messages[user1]:
-            messages = self.private_messages[user1][user2][-50:]  # 最近50条消息
+            messages = self.private_messages[user1][user2][-HISTORY_WINDOW:]
         return messages
 
     async def handle_message(self, websocket, message):
         data = json.loads(message)
         message_type = data.get("type")
         
-        if message_type == "login":
+        if message_type == "ping":
+            await self.send_message(websocket, {"type": "pong"})
+            
+        elif message_type == "login":
             # 验证令牌
             token = data.get("token")
             user_info = await self.verify_token(token)
             
             if user_info and user_info.get('success'):
                 username = user_info['username']
-                self.users[websocket] = username
-                
-                # 发送系统消息
-                system_message = {
-                    "type": "system",
-                    "content": f"{username} 加入了聊天室",
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-                self.messages_history.append(system_message)
-                await self.broadcast(system_message)
-                self.save_messages()
+                session = self.sessions.create(username, websocket)
+                await self.attach_user(websocket, username, data.get("encoding"), session)
                 
-                # 发送历史消息
-                for hist_msg in self.messages_history[-50:]:  # 只发送最近50条消息
-                    await websocket.send(json.dumps(hist_msg))
+                # 发送历史消息，跳过已屏蔽用户的消息
+                blocked = self.blocks.blocked.get(username, ())
+                for hist_msg in self.messages_history[-HISTORY_WINDOW:]:
+                    if hist_msg.sender not in blocked:
+                        await self.send_message(websocket, hist_msg)
                     
-                # 发送未读的私聊消息
-                if username in self.private_messages:
-                    for from_user, messages in self.private_messages[username].items():
-                        for msg in messages[-50:]:  # 每个用户最近50条
-                            if msg['status'] == 'sent':
-                                await websocket.send(json.dumps(msg))
+                # 投递第一批离线消息，后续批次在客户端确认后发送
+                await self.send_offline_batch(websocket, username)
+                
+        elif message_type == "resume":
+            # 断线重连时从会话重放缓冲恢复，无需重放历史；令牌仍需有效，登出后不能恢复
+            user_info = await self.verify_token(data.get("token"))
+            last_seq = data.get("last_seq")
+            session = None
+            if user_info and user_info.get('success'):
+                session = self.sessions.resume(data.get("session_id"), last_seq, websocket, user_info['username'])
+            if session is None:
+                await self.send_message(websocket, {"type": "resume_failed"})
+                return
+            await self.attach_user(websocket, session.username, data.get("encoding"), session,
+                                   replay=session.replay(last_seq))
+            await self.send_offline_batch(websocket, session.username)
+            
+        elif message_type == "offline_ack":
+            if websocket not in self.users:
+                return
+            
+            username = self.users[websocket]
+            seq = data.get("seq")
+            if isinstance(seq, int):
+                self.mailbox.ack(username, seq)
+                await self.send_offline_batch(websocket, username)
                 
         elif message_type == "load_private_history":
             if websocket not in self.users:
@@ -308,7 +644,7 @@ class ChatServer:
             if other_user:
                 history = await self.load_private_history(username, other_user)
                 for msg in history:
-                    await websocket.send(json.dumps(msg))
+                    await self.send_message(websocket, msg)
                     
         elif message_type == "chat":
             if websocket not in self.users:
@@ -316,16 +652,27 @@ class ChatServer:
             
             username = self.users[websocket]
             content = self.filter_sensitive_words(data["content"])
-            chat_message = {
-                "type": "chat",
-                "username": username,
-                "content": content,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
+            chat_message = MessageRecord.chat(username, content)
             self.messages_history.append(chat_message)
-            await self.broadcast(chat_message)
+            await self.broadcast(chat_message, sender=username)
             self.save_messages()
             
+        elif message_type == "typing":
+            # 输入状态走瞬时事件通道，不保存、不重放
+            if websocket not in self.users:
+                return
+            
+            username = self.users[websocket]
+            target = data.get("to") or None
+            if target is not None and not isinstance(target, str):
+                return
+            self.ephemeral.publish(username, target, {
+                "type": "typing",
+                "from": username,
+                "to": target,
+                "active": bool(data.get("active"))
+            })
+            
         elif message_type == "private":
             if websocket not in self.users:
                 return
@@ -338,11 +685,11 @@ class ChatServer:
                 success, message = await self.send_private_message(from_username, to_username, content)
                 if not success:
                     # 通知发送者私聊失败
-                    await websocket.send(json.dumps({
+                    await self.send_message(websocket, {
                         "type": "system",
                         "content": message,
                         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }))
+                    })
                     
         elif message_type == "mark_read":
             if websocket not in self.users:
@@ -370,11 +717,11 @@ class ChatServer:
             block_username = data.get("username")
             if block_username:
                 self.block_user(username, block_username)
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     "type": "system",
                     "content": f"已屏蔽用户 {block_username}",
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }))
+                })
                 
         elif message_type == "unblock_user":
             if websocket not in self.users:
@@ -384,17 +731,23 @@ class ChatServer:
             unblock_username = data.get("username")
             if unblock_username:
                 self.unblock_user(username, unblock_username)
-                await websocket.send(json.dumps({
+                await self.send_message(websocket, {
                     "type": "system",
                     "content": f"已取消屏蔽用户 {unblock_username}",
                         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }))
+                    })
             
     async def ws_handler(self, websocket):
         """WebSocket连接处理函数"""
         try:
             await self.register(websocket)
             async for message in websocket:
+                stats = self.connection_stats.get(websocket)
+                if stats is None:
+                    break  # 连接已被心跳检测回收
+                # 文本帧按 UTF-8 编码后的字节数统计
+                stats.record_in(len(message.encode('utf-8')) if isinstance(message, str) else len(message))
+                self.heartbeat.touch(websocket)
                 await self.handle_message(websocket, message)
         except websockets.exceptions.ConnectionClosed:
             pass
@@ -407,7 +760,7 @@ class ChatServer:
             self.ws_handler,
             host,
             port,
-            ping_interval=None  # 禁用ping以避免一些连接问题
+            ping_interval=None  # 禁用协议层ping，改用应用层心跳检测死连接
         )
 
 # 命令行控制接口
@@ -434,31 +787,56 @@ class ServerCommands:
         while True:
             command = await asyncio.get_event_loop().run_in_executor(None, input, "Luo² Chat Console> ")
             if command.lower() == "users":
-                print(f"当前在线用户: {list(self.chat_server.users.values())}")
+                print(f"当前在线用户: {self.chat_server.presence.online_users()}")
             elif command.lower() == "count":
                 print(f"当前连接数: {len(self.chat_server.clients)}")
+            elif command.lower() == "connections":
+                summary = self.chat_server.connection_summary()
+                rss = summary['rss']
+                print(f"连接数: {summary['connections']}")
+                print(f"收到: {summary['messages_in']} 条 / {summary['bytes_in']} 字节")
+                print(f"发出: {summary['messages_out']} 条 / {summary['bytes_out']} 字节")
+                print(f"写缓冲: {summary['write_buffer']} 字节（单连接最大 {summary['max_write_buffer']} 字节），"
+                      f"待写消息: {summary['pending_writes']} 条")
+                print(f"重放缓冲: {summary['replay_buffered']} 条，"
+                      f"可恢复会话: {summary['detached_sessions']} 个 / {summary['detached_buffered']} 条")
+                print(f"进程内存: {rss / 1024 / 1024:.1f} MB" if rss is not None else "进程内存: 未知")
             elif command.startswith("broadcast "):
                 message = command[10:]
-                system_message = {
-                    "type": "system",
-                    "content": f"系统广播: {message}",
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
+                system_message = MessageRecord.system(f"系统广播: {message}")
                 self.chat_server.messages_history.append(system_message)
                 await self.chat_server.broadcast(system_message)
                 self.chat_server.save_messages()
             elif command.lower() == "history":
                 print(f"历史消息数量: {len(self.chat_server.messages_history)}")
                 for msg in self.chat_server.messages_history[-10:]:  # 显示最近10条消息
-                    print(f"[{msg['timestamp']}] {msg.get('username', 'System')}: {msg['content']}")
+                    print(f"[{msg.timestamp}] {msg.sender or 'System'}: {msg.content}")
+            elif command.startswith("export "):
+                parts = command.split()
+                if len(parts) != 5 or parts[1] not in ('lobby', 'private'):
+                    print("用法: export <lobby|private> <开始日期> <结束日期> <输出文件>")
+                    continue
+                try:
+                    count = await self.chat_server.export_history(parts[1], parts[2], parts[3], parts[4])
+                    print(f"已导出 {count} 条消息到 {parts[4]}")
+                except ValueError:
+                    print("日期格式应为 YYYY-MM-DD")
+                except OSError as e:
+                    print(f"导出失败: {str(e)}")
+            elif command.lower() == "compact":
+                await self.chat_server.compact_history()
+                print("归档完成")
             elif command.lower() == "copyright":
                 print(self.copyright_info)
             elif command.lower() == "help":
                 print("""可用命令:
                 users - 显示在线用户
                 count - 显示当前连接数
+                connections - 显示连接资源统计
                 broadcast <消息> - 发送系统广播
                 history - 显示最近的聊天记录
+                export <lobby|private> <开始日期> <结束日期> <输出文件> - 导出聊天记录
+                compact - 立即归档旧消息
                 copyright - 显示版权信息
                 help - 显示此帮助
                 exit - 退出服务器
@@ -477,6 +855,7 @@ async def main():
     
     await asyncio.gather(
         server,
+        chat_server.run_compactor(),
         commands.handle_commands()
     )
 
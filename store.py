@@ -0,0 +1,171 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 分段锁数量
+LOCK_STRIPES = 64
+# 变更后延迟写盘的时间（秒），期间的变更合并为一次写入
+SAVE_DELAY = 0.05
+
+
+class StripedLock:
+    """按键哈希分段的锁，不同键的操作大多落在不同的锁上"""
+
+    def __init__(self, stripes=LOCK_STRIPES):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+
+def atomic_write_json(filename, data):
+    """先写入同目录下的临时文件再原子替换，避免写到一半的文件"""
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filename), dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class JsonStore:
+    """线程安全的 JSON 持久化字典
+
+    读写按键分段加锁，记录按写时复制替换，因此 dict(self.data) 就是一致的快照。
+    写盘由后台线程完成，SAVE_DELAY 内的变更合并为一次写入，请求线程不等待磁盘。
+    """
+
+    def __init__(self, filename, save_delay=SAVE_DELAY):
+        self.filename = filename
+        self.save_delay = save_delay
+        self.data = {}
+        self.locks = StripedLock()
+        self.write_lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.writer = None
+
+    def load(self):
+        try:
+            if os.path.exists(self.filename):
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    self.data = json.load(f)
+        except Exception as e:
+            logger.error(f"加载文件 {self.filename} 失败: {str(e)}")
+            self.data = {}
+        return self
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def __len__(self):
+        return len(self.data)
+
+    def save(self):
+        """标记有变更，由后台线程写盘"""
+        if self.writer is None:
+            with self.write_lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._write_loop, daemon=True)
+                    self.writer.start()
+                    atexit.register(self.flush)
+        self.dirty.set()
+
+    def _write_loop(self):
+        while True:
+            self.dirty.wait()
+            time.sleep(self.save_delay)
+            self.flush()
+
+    def flush(self):
+        """立即写入所有未保存的变更"""
+        with self.write_lock:
+            if not self.dirty.is_set():
+                return
+            # 先清除标记再取快照，取快照之后的变更会再次触发写盘
+            self.dirty.clear()
+            try:
+                atomic_write_json(self.filename, dict(self.data))
+            except Exception as e:
+                logger.error(f"保存文件 {self.filename} 失败: {str(e)}")
+
+
+class UserStore(JsonStore):
+    """用户数据，按用户名建立索引保证注册时用户名唯一"""
+
+    def load(self):
+        super().load()
+        self.by_username = {}
+        for user_id, user in self.data.items():
+            if isinstance(user, dict) and user.get('username'):
+                self.by_username[user['username']] = user_id
+        self.id_lock = threading.Lock()
+        self.next_id = max((int(uid) for uid in self.data if uid.isdigit()), default=0) + 1
+        return self
+
+    def find_by_username(self, username):
+        """返回 (user_id, 用户数据)，不存在时返回 (None, None)"""
+        user_id = self.by_username.get(username)
+        if user_id is None:
+            return None, None
+        return user_id, self.data.get(user_id)
+
+    def create(self, username, password_hash, created_at):
+        """创建用户，用户名已存在时返回 None"""
+        with self.locks(username):
+            if username in self.by_username:
+                return None
+            with self.id_lock:
+                user_id = str(self.next_id)
+                self.next_id += 1
+            self.data[user_id] = {
+                'username': username,
+                'password': password_hash,
+                'created_at': created_at
+            }
+            self.by_username[username] = user_id
+        self.save()
+        return user_id
+
+    def update(self, user_id, **fields):
+        """更新用户字段，记录整体替换"""
+        with self.locks(user_id):
+            user = self.data.get(user_id)
+            if user is None:
+                return False
+            self.data[user_id] = {**user, **fields}
+        self.save()
+        return True
+
+
+class SessionStore(JsonStore):
+    """登录会话数据"""
+
+    def create(self, token, user_id, expiry):
+        with self.locks(token):
+            self.data[token] = {
+                'user_id': user_id,
+                'expiry': expiry
+            }
+        self.save()
+
+    def delete(self, token):
+        with self.locks(token):
+            session = self.data.pop(token, None)
+        if session is not None:
+            self.save()
+        return session
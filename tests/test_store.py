@@ -0,0 +1,216 @@
+"""用户与会话存储的并发压力测试
+
+运行测试:      python -m unittest tests.test_store
+吞吐量对比:    python tests/test_store.py --benchmark
+"""
+import json
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import SessionStore, UserStore  # noqa: E402
+
+
+def open_stores(directory):
+    users = UserStore(os.path.join(directory, 'users.json')).load()
+    sessions = SessionStore(os.path.join(directory, 'sessions.json')).load()
+    return users, sessions
+
+
+def run_workload(users, sessions, threads, per_thread):
+    """每个线程注册 per_thread 个用户，与其他线程争抢同名注册，然后登录、登出
+
+    返回 (操作数, 耗时秒数, 每个线程抢注成功的用户名列表)。
+    """
+    barrier = threading.Barrier(threads)
+    won = [[] for _ in range(threads)]
+    errors = []
+
+    def work(index):
+        try:
+            barrier.wait()
+            for i in range(per_thread):
+                username = f"user{index}_{i}"
+                user_id = users.create(username, 'hash', 'now')
+                assert user_id is not None
+                assert users.create(username, 'hash', 'now') is None
+                # 所有线程抢注同一批用户名，每个用户名只能有一个线程成功
+                if users.create(f"shared_{i}", 'hash', 'now') is not None:
+                    won[index].append(f"shared_{i}")
+                # 登录
+                found_id, user = users.find_by_username(username)
+                assert found_id == user_id and user['username'] == username
+                token = secrets.token_hex(32)
+                sessions.create(token, user_id, 'expiry')
+                # 一半用户登出
+                if i % 2:
+                    assert sessions.delete(token) is not None
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    # 注册、重复注册、抢注、查询、创建会话各一次，登出一半
+    ops = threads * per_thread * 5 + threads * (per_thread // 2)
+    return ops, elapsed, won
+
+
+class StoreConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        # 等后台写盘结束后再删除临时目录
+        for store in self.stores:
+            store.flush()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open_stores(self):
+        users, sessions = open_stores(self.directory)
+        self.stores += [users, sessions]
+        return users, sessions
+
+    def test_no_lost_updates(self):
+        threads, per_thread = 16, 200
+        users, sessions = self.open_stores()
+        _, _, won = run_workload(users, sessions, threads, per_thread)
+
+        # 同名注册每个用户名只成功一次
+        shared = [username for names in won for username in names]
+        self.assertEqual(len(shared), per_thread)
+        self.assertEqual(len(set(shared)), per_thread)
+
+        # 内存中没有丢失或重复的用户和会话
+        self.assertEqual(len(users), threads * per_thread + per_thread)
+        usernames = [user['username'] for user in users.data.values()]
+        self.assertEqual(len(usernames), len(set(usernames)))
+        self.assertEqual(len(sessions), threads * (per_thread - per_thread // 2))
+
+        # 写盘后重新加载与内存一致
+        users.flush()
+        sessions.flush()
+        reloaded_users, reloaded_sessions = self.open_stores()
+        self.assertEqual(reloaded_users.data, users.data)
+        self.assertEqual(reloaded_sessions.data, sessions.data)
+        self.assertEqual(reloaded_users.next_id, users.next_id)
+
+    def test_same_username_registered_once(self):
+        # 缩短线程切换间隔，让检查用户名和写入之间更容易被其他线程打断
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for round_index in range(20):
+                users = UserStore(os.path.join(self.directory, f'users{round_index}.json')).load()
+                self.stores.append(users)
+                barrier = threading.Barrier(16)
+                won = []
+
+                def work():
+                    barrier.wait()
+                    for i in range(200):
+                        if users.create(f"shared_{i}", 'hash', 'now') is not None:
+                            won.append(i)
+
+                workers = [threading.Thread(target=work) for _ in range(16)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                self.assertEqual(sorted(won), list(range(200)))
+                self.assertEqual(len(users), 200)
+        finally:
+            sys.setswitchinterval(interval)
+
+    def test_concurrent_updates_to_one_user(self):
+        users, _ = self.open_stores()
+        user_id = users.create('alice', 'hash', 'now')
+        barrier = threading.Barrier(8)
+
+        def work(index):
+            barrier.wait()
+            for i in range(200):
+                users.update(user_id, **{f"field{index}": i})
+
+        workers = [threading.Thread(target=work, args=(index,)) for index in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        users.flush()
+
+        # 不同线程更新的字段都保留了最后的值
+        expected = {f"field{index}": 199 for index in range(8)}
+        user = users.get(user_id)
+        self.assertEqual({key: user[key] for key in expected}, expected)
+        with open(users.filename, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)[user_id], user)
+
+    def test_no_partial_file_during_writes(self):
+        users, _ = self.open_stores()
+        stop = threading.Event()
+        failures = []
+
+        def reader():
+            # 原子替换保证任何时刻读到的都是完整的 JSON
+            while not stop.is_set():
+                try:
+                    with open(users.filename, 'r', encoding='utf-8') as f:
+                        json.load(f)
+                except FileNotFoundError:
+                    pass
+                except ValueError as e:
+                    failures.append(e)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        for i in range(500):
+            users.create(f"user{i}", 'hash', 'now')
+            if i % 50 == 0:
+                users.flush()
+        stop.set()
+        thread.join()
+        self.assertEqual(failures, [])
+
+
+def benchmark(thread_counts=(1, 2, 4, 8, 16, 32), per_thread=400):
+    """输出不同线程数下的吞吐量，并检查没有丢失更新"""
+    print(f"{'线程':>4} {'操作数':>8} {'操作/秒':>10}  一致")
+    for threads in thread_counts:
+        directory = tempfile.mkdtemp()
+        try:
+            users, sessions = open_stores(directory)
+            ops, elapsed, _ = run_workload(users, sessions, threads, per_thread)
+            users.flush()
+            sessions.flush()
+            reloaded_users, reloaded_sessions = open_stores(directory)
+            consistent = (
+                len(users) == threads * per_thread + per_thread
+                and reloaded_users.data == users.data
+                and reloaded_sessions.data == sessions.data
+            )
+            print(f"{threads:>4} {ops:>8} {ops / elapsed:>10.0f}  {'是' if consistent else '否'}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -1,23 +1,123 @@
-from flask import Flask, render_template, send_from_directory, request, send_file, jsonify
+from flask import Flask, request, Response, jsonify, abort
 import os
 import json
+import gzip
+import hashlib
+import mimetypes
 
-app = Flask(__name__)
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+app = Flask(__name__, static_folder=None)  # 静态资源由下方内存路由提供
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+CONFIG_PATH = os.path.join(BASE_DIR, 'config.json')
+
+DEFAULT_CONFIG = {
+    "ws_domain": "localhost",
+    "api_domain": "localhost",
+    "web_port": 8002,
+    "ws_port": 8000,
+    "api_port": 8001,
+    "ws_encoding": "json"
+}
+
+# 带指纹的资源可被长期缓存，其余资源每次通过ETag验证
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+class Asset:
+    """预加载到内存的静态资源及其压缩版本"""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {None: body}  # {编码: 内容}，None 表示未压缩
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        # 已压缩的格式（png、mp3等）压缩收益很小，不保留压缩版本
+        if len(compressed) < len(body) * 0.9:
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body)
+            self.variants['gzip'] = compressed
+        self.etags = {
+            encoding: f"{self.digest}-{encoding}" if encoding else self.digest
+            for encoding in self.variants
+        }
+
+    def response(self, immutable=False):
+        """按 Accept-Encoding 选择版本，并处理条件请求"""
+        encoding = None
+        if len(self.variants) > 1:
+            # 按 q 值选择，q=0 表示拒绝该编码，同等权重时优先 br
+            encoding = request.accept_encodings.best_match(
+                [candidate for candidate in self.variants if candidate]
+            )
+
+        headers = {
+            'ETag': f'"{self.etags[encoding]}"',
+            'Cache-Control': IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+        }
+        if len(self.variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        if request.if_none_match.contains(self.etags[encoding]):
+            return Response(status=304, headers=headers)
+        response = Response(self.variants[encoding], mimetype=self.mimetype, headers=headers)
+        if encoding is None and request.range is not None:
+            # Range 请求（如音频拖动）交给 werkzeug 处理，只对未压缩版本支持
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(self.body))
+        return response
+
+def load_static_assets():
+    """启动时把 static 目录读入内存"""
+    assets = {}
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, STATIC_DIR).replace(os.sep, '/')
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            with open(path, 'rb') as f:
+                assets[rel_path] = Asset(f.read(), mimetype)
+    return assets
+
+static_assets = load_static_assets()
+
+def asset_url(path):
+    """返回带内容指纹的静态资源地址"""
+    asset = static_assets.get(path)
+    if asset is None:
+        return f'/static/{path}'
+    return f'/static/{path}?v={asset.digest}'
+
+def load_page(name):
+    """启动时渲染模板，页面不依赖请求上下文"""
+    html = app.jinja_env.get_template(name).render(asset_url=asset_url)
+    return Asset(html.encode('utf-8'), 'text/html')
+
+pages = {
+    'index': load_page('index.html'),
+    'callback': load_page('callback.html'),
+}
+
+# 读取配置文件，文件修改时间变化时才重新加载
+_config_cache = {'mtime': None, 'config': None}
 
-# 读取配置文件
 def load_config():
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        if _config_cache['mtime'] != mtime:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                _config_cache['config'] = json.load(f)
+            _config_cache['mtime'] = mtime
+        return _config_cache['config']
     except:
-        return {
-            "ws_domain": "localhost",
-            "api_domain": "localhost",
-            "web_port": 8002,
-            "ws_port": 8000,
-            "api_port": 8001
-        }
+        return DEFAULT_CONFIG
 
 @app.route('/config')
 def get_config():
@@ -26,33 +126,40 @@ def get_config():
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return pages['index'].response()
 
 @app.route('/callback')
 def callback():
     # 显示回调页面，该页面会处理OAuth2回调并与API服务器通信
-    return render_template('callback.html')
+    return pages['callback'].response()
+
+def send_asset(path):
+    asset = static_assets.get(path)
+    if asset is None:
+        abort(404)
+    # 只有带正确指纹的请求才允许长期缓存
+    return asset.response(immutable=request.args.get('v') == asset.digest)
 
 @app.route('/static/<path:path>')
 def send_static(path):
-    return send_from_directory('static', path)
+    return send_asset(path)
 
 @app.route('/favicon.ico')
 def favicon():
-    return send_from_directory('static', 'Luo2Icon-mini.png', mimetype='image/png')
+    return send_asset('Luo2Icon-mini.png')
 
 # 添加 PWA 图标路由
 @app.route('/apple-touch-icon.png')
 def apple_touch_icon():
-    return send_from_directory('static', 'Luo2Icon-mini.png', mimetype='image/png')
+    return send_asset('Luo2Icon-mini.png')
 
 @app.route('/icon-192.png')
 def icon_192():
-    return send_from_directory('static', 'Luo2Icon-mini.png', mimetype='image/png')
+    return send_asset('Luo2Icon-mini.png')
 
 @app.route('/icon-512.png')
 def icon_512():
-    return send_from_directory('static', 'Luo2Icon-mini.png', mimetype='image/png')
+    return send_asset('Luo2Icon-mini.png')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8002) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=8002)